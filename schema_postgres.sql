@@ -7,8 +7,9 @@
 -- Partitioning is CRITICAL for 6GB/day data to drop old data easily and query faster.
 CREATE TABLE raw_pool (
     id BIGSERIAL, -- Use BIGSERIAL for massive amounts of rows
-    phone_number VARCHAR(20) NOT NULL,
-    provider VARCHAR(20),
+    phone_number BIGINT NOT NULL, -- Stored without the leading zero (8B vs ~20B as text);
+                                  -- ingest only accepts national numbers, '0' + non-zero digit
+    provider SMALLINT NOT NULL, -- 0 other, 1 tsel, 2 isat, 3 xl (PROVIDER_CODES in voucher_postgres.py)
     url_source TEXT,
     imported_at TIMESTAMP NOT NULL DEFAULT NOW(),
     file_source TEXT,
@@ -17,30 +18,76 @@ CREATE TABLE raw_pool (
 
 -- Create Partitions (Example: Monthly or Daily depending on volume)
 -- For 6GB/day, Daily partitions are recommended to keep index size manageable.
+-- Each day is sub-partitioned by provider, so `provider = 1` (tsel) plus the
+-- imported_at filter prunes to exactly one leaf per day.
 CREATE TABLE raw_pool_y2025m12d01 PARTITION OF raw_pool
-    FOR VALUES FROM ('2025-12-01 00:00:00') TO ('2025-12-02 00:00:00');
+    FOR VALUES FROM ('2025-12-01 00:00:00') TO ('2025-12-02 00:00:00')
+    PARTITION BY LIST (provider);
+CREATE TABLE raw_pool_y2025m12d01_tsel PARTITION OF raw_pool_y2025m12d01 FOR VALUES IN (1);
+CREATE TABLE raw_pool_y2025m12d01_isat PARTITION OF raw_pool_y2025m12d01 FOR VALUES IN (2);
+CREATE TABLE raw_pool_y2025m12d01_xl PARTITION OF raw_pool_y2025m12d01 FOR VALUES IN (3);
+CREATE TABLE raw_pool_y2025m12d01_other PARTITION OF raw_pool_y2025m12d01 FOR VALUES IN (0);
 
 CREATE TABLE raw_pool_y2025m12d02 PARTITION OF raw_pool
-    FOR VALUES FROM ('2025-12-02 00:00:00') TO ('2025-12-03 00:00:00');
+    FOR VALUES FROM ('2025-12-02 00:00:00') TO ('2025-12-03 00:00:00')
+    PARTITION BY LIST (provider);
+CREATE TABLE raw_pool_y2025m12d02_tsel PARTITION OF raw_pool_y2025m12d02 FOR VALUES IN (1);
+CREATE TABLE raw_pool_y2025m12d02_isat PARTITION OF raw_pool_y2025m12d02 FOR VALUES IN (2);
+CREATE TABLE raw_pool_y2025m12d02_xl PARTITION OF raw_pool_y2025m12d02 FOR VALUES IN (3);
+CREATE TABLE raw_pool_y2025m12d02_other PARTITION OF raw_pool_y2025m12d02 FOR VALUES IN (0);
 -- You would have a cron job to create these future partitions automatically
+-- (see init_db_partitions in voucher_postgres.py)
 
 -- Indices on the Partitioned Table
 -- Postgres automatically propagates these to partitions
 CREATE INDEX idx_raw_pool_phone ON raw_pool (phone_number);
 CREATE INDEX idx_raw_pool_provider_date ON raw_pool (provider, imported_at);
+-- BRIN for the freshness filter: data is append-only with increasing imported_at,
+-- so block-range min/max pruning is nearly free to maintain and tiny on disk.
+CREATE INDEX idx_raw_pool_imported_brin ON raw_pool USING BRIN (imported_at) WITH (pages_per_range = 32);
 
 
--- 3. Create SALES HISTORY table
+-- 3. Create SALES HISTORY table, partitioned by sold_at on the same daily
+-- boundaries as raw_pool. The 30-day Blacklist filter prunes to the recent
+-- partitions; ones past the window can be detached/dropped once the sales
+-- record is no longer needed (nothing in this repo drops them).
 CREATE TABLE sales_history (
-    id BIGSERIAL PRIMARY KEY,
-    phone_number VARCHAR(20) NOT NULL,
+    id BIGSERIAL,
+    phone_number BIGINT NOT NULL,
     customer_name VARCHAR(100),
     sold_at TIMESTAMP NOT NULL DEFAULT NOW(),
-    transaction_id VARCHAR(50)
-);
+    transaction_id VARCHAR(50),
+    PRIMARY KEY (id, sold_at) -- Must include the partition key
+) PARTITION BY RANGE (sold_at);
+
+-- Index-only scans need an up-to-date visibility map. sales_history is
+-- insert-only, so vacuum has to be triggered by inserts, not dead tuples.
+-- (Set per partition: a partitioned table has no storage of its own.)
+CREATE TABLE sales_history_y2025m12d01 PARTITION OF sales_history
+    FOR VALUES FROM ('2025-12-01 00:00:00') TO ('2025-12-02 00:00:00')
+    WITH (autovacuum_vacuum_scale_factor = 0.01, autovacuum_vacuum_insert_scale_factor = 0.01);
+
+CREATE TABLE sales_history_y2025m12d02 PARTITION OF sales_history
+    FOR VALUES FROM ('2025-12-02 00:00:00') TO ('2025-12-03 00:00:00')
+    WITH (autovacuum_vacuum_scale_factor = 0.01, autovacuum_vacuum_insert_scale_factor = 0.01);
+-- Future partitions: see init_sales_partitions in voucher_postgres.py
+
+-- Catch-all so a sale never fails with "no partition of relation found for row"
+-- when the maintenance job hasn't created today's partition yet.
+-- (init_sales_partitions moves a day's rows out of here before creating its partition.)
+CREATE TABLE sales_history_default PARTITION OF sales_history DEFAULT
+    WITH (autovacuum_vacuum_scale_factor = 0.01, autovacuum_vacuum_insert_scale_factor = 0.01);
 
 -- Index for the Anti-Join (Deduplication Check)
 CREATE INDEX idx_sales_phone_sold ON sales_history (phone_number, sold_at);
+-- Covering index for the Blacklist CTE: the 30-day sold_at range scan returns
+-- phone_number straight from the index (index-only scan, no heap fetch).
+-- A partial "last 30 days" variant isn't possible (predicate must be immutable).
+CREATE INDEX idx_sales_sold_covering ON sales_history (sold_at) INCLUDE (phone_number);
+
+-- NOTE: no bloom index on sales_history.phone_number. Equality probes from the
+-- anti-join are already served by idx_sales_phone_sold, and a bloom index can't
+-- be bitmap-ANDed with the BRIN index, which is on raw_pool, not this table.
 
 
 -- 4. THE QUERY (Implementation in Postgres)
@@ -50,7 +97,7 @@ CREATE INDEX idx_sales_phone_sold ON sales_history (phone_number, sold_at);
 WITH Candidates AS (
     SELECT phone_number
     FROM raw_pool
-    WHERE provider = 'tsel' 
+    WHERE provider = 1 -- tsel
       AND imported_at >= NOW() - INTERVAL '3 days' -- Postgres uses Partition Pruning here
 ),
 Blacklist AS (
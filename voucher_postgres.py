@@ -1,12 +1,51 @@
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import execute_values
 import csv
+import io
 import os
+import re
 import time
 import datetime
+import itertools
+import struct
+import urllib.parse
+import weakref
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+try:
+    # Optional: vectorized CSV parsing / provider tagging
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+try:
+    # Optional: vectorized dummy data generation
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    # Optional: JIT-compiled ingestion kernel, used when PyArrow isn't installed
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    # Optional: Arrow-native ingestion (binary COPY straight from an Arrow table)
+    import adbc_driver_postgresql.dbapi as adbc_pg
+except ImportError:
+    adbc_pg = None
+
+try:
+    # Optional: asyncio driver with binary COPY
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
 # Load environment variables (DB credentials)
 load_dotenv()
 
@@ -17,15 +56,105 @@ DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASS = os.getenv("DB_PASS", "password")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
-# Connection Pool
+# Demo: run the asyncpg variant instead of the default COPY/thread-pool path
+USE_ASYNCPG = os.getenv("USE_ASYNCPG", "0") == "1"
+
+# Session settings applied to every pooled connection.
+# Partition-wise join/aggregate are off by default; work_mem keeps the
+# anti-join's hash table in memory instead of spilling to disk.
+SESSION_SETTINGS = {
+    'enable_partitionwise_join': 'on',
+    'enable_partitionwise_aggregate': 'on',
+    'work_mem': '256MB',
+}
+
+# Phone prefix -> provider
+PROVIDER_MAP = {'0812': 'tsel', '0857': 'isat', '0819': 'xl'}
+# Every provider value written to raw_pool (one LIST sub-partition each)
+PROVIDERS = list(PROVIDER_MAP.values()) + ['other']
+# raw_pool stores the provider as a SMALLINT code (stored data, never renumber)
+PROVIDER_CODES = {'other': 0, 'tsel': 1, 'isat': 2, 'xl': 3}
+# Phone prefix -> provider code, for the per-row ingestion paths
+PREFIX_CODES = {prefix: PROVIDER_CODES[provider] for prefix, provider in PROVIDER_MAP.items()}
+
+# Phone numbers are stored as BIGINT without their leading zero
+# (e.g. 081234567890 -> 81234567890); the order queries add it back.
+# That only round-trips national numbers with exactly one leading zero, so
+# every ingest path rejects anything else ('+', spaces, '62...', '00...').
+PHONE_PATTERN = '0[1-9][0-9]{0,16}' # At most 18 digits, fits BIGINT
+PHONE_RE = re.compile(PHONE_PATTERN)
+
+# Streaming ingestion
+CHUNK_ROWS = 50_000 # Rows per COPY (pure-Python path)
+BLOCK_BYTES = 8 * 1024 * 1024 # Bytes of CSV per COPY (PyArrow / Numba paths)
+COMMIT_EVERY = 10 # Chunks per transaction
+
+# COPY ... WITH (FORMAT binary) framing, see "Binary Format" in the COPY docs
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('>h', -1)
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+
+# Order processing
+ORDER_WORKERS = 4 # Requirements processed in parallel, each holds one pool connection
+
+# OPTIMIZED POSTGRES QUERY
+# Uses CTEs and standard Anti-Join
+# Postgres Partition pruning kicks in because of 'imported_at' filter
+# Pick + record the sale in ONE statement. A number can sit in several pool
+# rows (same number in two files / on two days), so only its earliest fresh
+# row is a candidate: no duplicates within an order, and concurrent orders
+# contend for that same row lock (SKIP LOCKED makes the loser take another
+# number instead of waiting). An order whose statement starts after another
+# order's commit sees that sale through the Blacklist.
+# Shared by the PREPAREd psycopg2 path and asyncpg:
+# $1 provider code, $2 freshness days, $3 cutoff days, $4 qty, $5 customer
+PICK_ORDER_SQL = """
+    WITH Blacklist AS (
+        SELECT phone_number
+        FROM sales_history
+        WHERE sold_at >= NOW() - $3 * INTERVAL '1 day'
+    ),
+    Picked AS (
+        SELECT r.phone_number
+        FROM raw_pool r
+        LEFT JOIN Blacklist b ON r.phone_number = b.phone_number
+        WHERE r.provider = $1
+          AND r.imported_at >= NOW() - $2 * INTERVAL '1 day'
+          AND b.phone_number IS NULL
+          AND NOT EXISTS (
+              SELECT 1
+              FROM raw_pool e
+              WHERE e.phone_number = r.phone_number
+                AND e.provider = $1
+                AND e.imported_at >= NOW() - $2 * INTERVAL '1 day'
+                AND (e.imported_at, e.id) < (r.imported_at, r.id)
+          )
+        LIMIT $4
+        FOR UPDATE OF r SKIP LOCKED
+    ),
+    Sold AS (
+        INSERT INTO sales_history (phone_number, customer_name, sold_at)
+        SELECT phone_number, $5, NOW()
+        FROM Picked
+        RETURNING phone_number
+    )
+    SELECT '0' || phone_number FROM Sold
+"""
+
+# Pooled connections that already ran PREPARE pick_order (entries vanish
+# when the pool closes/replaces a connection)
+prepared_conns = weakref.WeakSet()
+
+# Connection Pool (thread-safe: order requirements run on worker threads)
 try:
-    db_pool = psycopg2.pool.SimpleConnectionPool(
+    db_pool = psycopg2.pool.ThreadedConnectionPool(
         1, 10,
         host=DB_HOST,
         database=DB_NAME,
         user=DB_USER,
         password=DB_PASS,
-        port=DB_PORT
+        port=DB_PORT,
+        options=' '.join(f"-c {name}={value}" for name, value in SESSION_SETTINGS.items())
     )
     print("PostgreSQL connection pool created successfully.")
 except Exception as e:
@@ -45,7 +174,7 @@ def release_db_connection(conn):
 
 def init_db_partitions():
     """
-    Creates partitions for the next few days.
+    Creates partitions for the next few days, sub-partitioned by provider.
     In production, this should be a scheduled maintenance job.
     """
     conn = get_db_connection()
@@ -65,11 +194,20 @@ def init_db_partitions():
             cur.execute(f"SELECT to_regclass('{part_name}');")
             if not cur.fetchone()[0]:
                 print(f"Creating partition: {part_name}")
+                # Day partition is itself split by provider, so a
+                # provider + date filter prunes down to one leaf per day
                 sql = f"""
                     CREATE TABLE {part_name} PARTITION OF raw_pool
-                    FOR VALUES FROM ('{day_start}') TO ('{day_end}');
+                    FOR VALUES FROM ('{day_start}') TO ('{day_end}')
+                    PARTITION BY LIST (provider);
                 """
                 cur.execute(sql)
+
+                for provider in PROVIDERS:
+                    cur.execute(f"""
+                        CREATE TABLE {part_name}_{provider} PARTITION OF {part_name}
+                        FOR VALUES IN ({PROVIDER_CODES[provider]});
+                    """)
         
         conn.commit()
         print("Partitions initialized.")
@@ -80,131 +218,687 @@ def init_db_partitions():
         cur.close()
         release_db_connection(conn)
 
-def ingest_file_postgres(filename):
+def init_sales_partitions():
     """
-    High-performance ingestion using COPY or execute_values.
+    Creates sales_history partitions (by sold_at) for the next few days,
+    on the same daily boundaries as raw_pool, plus the DEFAULT partition
+    that catches sales on days the job didn't cover.
+    Each day is committed on its own, so one failing day doesn't undo the others.
+    Expired partitions are not dropped here: sales_history is also the sales record.
     """
     conn = get_db_connection()
     try:
         cur = conn.cursor()
+
+        # Insert-only table: let inserts trigger autovacuum so the
+        # visibility map stays current for index-only scans
+        storage = "WITH (autovacuum_vacuum_scale_factor = 0.01, autovacuum_vacuum_insert_scale_factor = 0.01)"
+
+        cur.execute("SELECT to_regclass('sales_history_default');")
+        if not cur.fetchone()[0]:
+            print("Creating partition: sales_history_default")
+            cur.execute(f"CREATE TABLE sales_history_default PARTITION OF sales_history DEFAULT {storage};")
+        conn.commit()
         
-        # Prepare data in memory (chunking is recommended for 6GB files)
-        # For huge files, we should stream this. For <1GB chunks, list is fine.
-        records = []
-        with open(filename, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                phone = row['phone']
-                # Determine provider
-                if phone.startswith('0812'): provider = 'tsel'
-                elif phone.startswith('0857'): provider = 'isat'
-                elif phone.startswith('0819'): provider = 'xl'
-                else: provider = 'other'
-                
-                records.append((
-                    phone, 
-                    provider, 
-                    row['url'], 
-                    row['timestamp'], 
-                    filename
-                ))
-
-        print(f"Ingesting {len(records)} records to Postgres...")
-        start = time.time()
+        # Create partitions for today and next 3 days
+        base_date = datetime.date.today()
+        for i in range(4):
+            day_start = base_date + datetime.timedelta(days=i)
+            day_end = day_start + datetime.timedelta(days=1)
+            
+            # Format: sales_history_y2025m12d01
+            part_name = f"sales_history_y{day_start.strftime('%Y')}m{day_start.strftime('%m')}d{day_start.strftime('%d')}"
+            
+            cur.execute(f"SELECT to_regclass('{part_name}');")
+            if cur.fetchone()[0]:
+                continue
+
+            print(f"Creating partition: {part_name}")
+            try:
+                # Sales that already landed in DEFAULT for this day would violate
+                # the new partition's bound: park them, create, then re-insert
+                cur.execute("CREATE TEMP TABLE sales_moving (LIKE sales_history) ON COMMIT DROP;")
+                cur.execute("""
+                    WITH moved AS (
+                        DELETE FROM sales_history_default
+                        WHERE sold_at >= %s AND sold_at < %s
+                        RETURNING *
+                    )
+                    INSERT INTO sales_moving SELECT * FROM moved;
+                """, (day_start, day_end))
+                moved = cur.rowcount
+
+                sql = f"""
+                    CREATE TABLE {part_name} PARTITION OF sales_history
+                    FOR VALUES FROM ('{day_start}') TO ('{day_end}')
+                    {storage};
+                """
+                cur.execute(sql)
+                cur.execute("INSERT INTO sales_history SELECT * FROM sales_moving;")
+                conn.commit()
+                if moved:
+                    print(f"  Moved {moved} rows from sales_history_default into {part_name}")
+            except Exception as e:
+                conn.rollback()
+                print(f"Error creating partition {part_name}: {e}")
         
-        # Method 1: execute_values (Fast)
-        query = """
-            INSERT INTO raw_pool (phone_number, provider, url_source, imported_at, file_source)
-            VALUES %s
+        print("Sales partitions initialized.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error creating sales partitions: {e}")
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def classify_providers(phones):
+    """
+    Vectorized provider lookup over an Arrow string array, returns int16 codes.
+    One C-level pass over the column instead of a Python if/elif per row.
+    """
+    prefix = pc.utf8_slice_codeunits(phones, 0, 4)
+    conditions = pc.make_struct(*[pc.equal(prefix, p) for p in PREFIX_CODES])
+    codes = [pa.scalar(code, pa.int16()) for code in PREFIX_CODES.values()]
+    return pc.case_when(conditions, *codes, pa.scalar(PROVIDER_CODES['other'], pa.int16()))
+
+def _pack_text(value):
+    """One text field in COPY binary format: int32 length + UTF-8 bytes."""
+    data = value.encode('utf-8')
+    return struct.pack('>i', len(data)) + data
+
+def _binary_copy_chunks(filename):
+    """
+    Pure-Python fallback: yields COPY BINARY buffers of up to CHUNK_ROWS
+    enriched rows each, so only one chunk is ever held in memory.
+    Binary format spares the server from lexing every field as text.
+    Rows of each chunk are sorted by (provider, imported_at, phone_number).
+    """
+    field_count = struct.pack('>h', 5)
+    file_field = _pack_text(filename)
+
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None) # Skip header
+        while True:
+            ts_micros = {} # Files usually repeat timestamps, parse each once per chunk
+            chunk = []
+            lines = 0
+            for row in itertools.islice(reader, CHUNK_ROWS):
+                lines += 1
+                if not row:
+                    continue # Blank line, skipped like the Numba/Arrow paths
+                phone, url, ts = row
+                if not PHONE_RE.fullmatch(phone):
+                    raise ValueError(f"Invalid phone number {phone!r} in {filename}")
+
+                # timestamp: int64 microseconds since 2000-01-01
+                micros = ts_micros.get(ts)
+                if micros is None:
+                    micros = ts_micros[ts] = (datetime.datetime.fromisoformat(ts) - PG_EPOCH) // datetime.timedelta(microseconds=1)
+
+                # Determine provider (SMALLINT code)
+                chunk.append((PREFIX_CODES.get(phone[:4], PROVIDER_CODES['other']), micros, int(phone), url))
+
+            if not lines:
+                return
+            if not chunk:
+                continue # Slice held only blank lines
+
+            # Pre-sort so rows land in index key order
+            chunk.sort(key=lambda row: row[:3])
+            buf = io.BytesIO()
+            buf.write(COPY_BINARY_HEADER)
+            for code, micros, phone, url in chunk:
+                buf.write(field_count + struct.pack('>iqih', 8, phone, 2, code)
+                          + _pack_text(url) + struct.pack('>iq', 8, micros) + file_field)
+            buf.write(COPY_BINARY_TRAILER)
+            buf.seek(0)
+            yield buf
+
+if numba is not None:
+    # --- NUMBA KERNELS: CSV bytes -> COPY BINARY rows, one parallel loop per pass ---
+    # Expects the plain input format: phone,url,YYYY-MM-DD HH:MM:SS
+    # (fields may be wrapped in double quotes, but must not contain commas).
+
+    @numba.njit(cache=True)
+    def _unquote(buf, start, end):
+        if end - start >= 2 and buf[start] == 34 and buf[end - 1] == 34: # '"'
+            return start + 1, end - 1
+        return start, end
+
+    @numba.njit(cache=True)
+    def _put_int(out, o, value, nbytes):
+        # Big-endian, as required by the binary COPY format
+        for k in range(nbytes):
+            out[o + k] = (value >> (8 * (nbytes - 1 - k))) & 0xFF
+        return o + nbytes
+
+    @numba.njit(cache=True)
+    def _read_int(buf, start, end):
+        value = 0
+        for j in range(start, end):
+            digit = np.int64(buf[j]) - 48
+            if digit < 0 or digit > 9:
+                return -1
+            value = value * 10 + digit
+        return value
+
+    @numba.njit(cache=True)
+    def _days_in_month(y, m):
+        if m == 2:
+            return 29 if (y % 4 == 0 and y % 100 != 0) or y % 400 == 0 else 28
+        return 30 if m in (4, 6, 9, 11) else 31
+
+    @numba.njit(parallel=True, cache=True)
+    def _parse_rows(buf, starts, ends, comma1, comma2, sizes, fixed_size,
+                    prefixes, codes, other_code, phones, providers, micros, ok):
+        """
+        Pass 1: locates the two commas, parses phone / provider / timestamp
+        and computes each encoded row size.
         """
-        execute_values(cur, query, records)
+        for i in numba.prange(starts.shape[0]):
+            start = starts[i]
+            end = ends[i]
+            if end > start and buf[end - 1] == 13: # Strip '\r' (CRLF files)
+                end -= 1
+                ends[i] = end
+            if end == start:
+                sizes[i] = 0 # Blank line, skipped
+                continue
+
+            c1 = -1
+            c2 = -1
+            for j in range(start, end):
+                if buf[j] == 44: # ','
+                    if c1 < 0:
+                        c1 = j
+                    else:
+                        c2 = j
+                        break
+            comma1[i] = c1
+            comma2[i] = c2
+            if c2 < 0:
+                sizes[i] = -1 # Malformed
+                continue
+
+            url_start, url_end = _unquote(buf, c1 + 1, c2)
+            sizes[i] = fixed_size + (url_end - url_start)
+
+            # phone_number: BIGINT (leading zero dropped by the integer parse),
+            # same rule as PHONE_PATTERN: '0', then a non-zero digit, 2-18 digits
+            phone_start, phone_end = _unquote(buf, start, c1)
+            phones[i] = _read_int(buf, phone_start, phone_end)
+            if (phones[i] < 0 or phone_end - phone_start < 2 or phone_end - phone_start > 18
+                    or buf[phone_start] != 48 or buf[phone_start + 1] == 48): # '0'
+                ok[i] = False
+
+            # provider: SMALLINT code from the 4-byte prefix
+            code = other_code
+            if phone_end - phone_start >= 4:
+                for k in range(prefixes.shape[0]):
+                    if (buf[phone_start] == prefixes[k, 0] and buf[phone_start + 1] == prefixes[k, 1]
+                            and buf[phone_start + 2] == prefixes[k, 2] and buf[phone_start + 3] == prefixes[k, 3]):
+                        code = codes[k]
+                        break
+            providers[i] = code
+
+            # imported_at: TIMESTAMP as int64 microseconds since 2000-01-01
+            ts_start, ts_end = _unquote(buf, c2 + 1, end)
+            micros[i] = 0
+            if ts_end - ts_start != 19:
+                ok[i] = False
+            else:
+                y = _read_int(buf, ts_start, ts_start + 4)
+                m = _read_int(buf, ts_start + 5, ts_start + 7)
+                d = _read_int(buf, ts_start + 8, ts_start + 10)
+                hh = _read_int(buf, ts_start + 11, ts_start + 13)
+                mi = _read_int(buf, ts_start + 14, ts_start + 16)
+                ss = _read_int(buf, ts_start + 17, ts_start + 19)
+                # Same acceptance as datetime.fromisoformat / Arrow: real
+                # calendar date, 'YYYY-MM-DD[ T]HH:MM:SS' separators
+                if (min(y, m, d, hh, mi, ss) < 0 or y < 1 or m < 1 or m > 12
+                        or d < 1 or d > _days_in_month(y, m) or hh > 23 or mi > 59 or ss > 59
+                        or buf[ts_start + 4] != 45 or buf[ts_start + 7] != 45 # '-'
+                        or (buf[ts_start + 10] != 32 and buf[ts_start + 10] != 84) # ' ' / 'T'
+                        or buf[ts_start + 13] != 58 or buf[ts_start + 16] != 58): # ':'
+                    ok[i] = False
+                    continue
+                # Days since 1970-01-01 (civil calendar, March-based year)
+                if m <= 2:
+                    y -= 1
+                era = y // 400
+                yoe = y - era * 400
+                doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+                doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+                days = era * 146097 + doe - 719468 - 10957 # 10957: 1970 -> 2000
+                micros[i] = (days * 86400 + hh * 3600 + mi * 60 + ss) * 1_000_000
+
+    @numba.njit(parallel=True, cache=True)
+    def _encode_rows(buf, comma1, comma2, sizes, offsets, phones, providers, micros, file_field, out):
+        """Pass 2: writes every row at its precomputed offset."""
+        for i in numba.prange(sizes.shape[0]):
+            if sizes[i] <= 0:
+                continue
+            o = offsets[i]
+            o = _put_int(out, o, 5, 2) # Field count
+
+            o = _put_int(out, o, 8, 4)
+            o = _put_int(out, o, phones[i], 8)
+
+            o = _put_int(out, o, 2, 4)
+            o = _put_int(out, o, providers[i], 2)
+
+            # url_source: TEXT, copied as-is
+            url_start, url_end = _unquote(buf, comma1[i] + 1, comma2[i])
+            o = _put_int(out, o, url_end - url_start, 4)
+            for j in range(url_start, url_end):
+                out[o] = buf[j]
+                o += 1
+
+            o = _put_int(out, o, 8, 4)
+            o = _put_int(out, o, micros[i], 8)
+
+            # file_source: pre-packed TEXT field
+            for j in range(file_field.shape[0]):
+                out[o + j] = file_field[j]
+
+def _numba_copy_chunks(filename):
+    """
+    Numba path: memory-maps the CSV and yields COPY BINARY buffers of about
+    BLOCK_BYTES of input each, encoded by the parallel kernels above.
+    Rows of each block are sorted by (provider, imported_at, phone_number).
+    """
+    data = np.memmap(filename, dtype=np.uint8, mode='r') if os.path.getsize(filename) else np.empty(0, np.uint8)
+    prefixes = np.array([list(prefix.encode()) for prefix in PREFIX_CODES], dtype=np.uint8)
+    codes = np.array(list(PREFIX_CODES.values()), dtype=np.int64)
+    file_field = np.frombuffer(_pack_text(filename), dtype=np.uint8)
+    # field count + phone + provider + url length + timestamp + file_source
+    fixed_size = 2 + (4 + 8) + (4 + 2) + 4 + (4 + 8) + file_field.shape[0]
+
+    pos = bytes(data[:64 * 1024]).find(b'\n') + 1 # Skip header
+    if pos == 0:
+        return
+    while pos < data.shape[0]:
+        end = min(pos + BLOCK_BYTES, data.shape[0])
+        newlines = np.flatnonzero(data[pos:end] == 10) + pos
+        if end == data.shape[0] and data[end - 1] != 10:
+            newlines = np.append(newlines, end) # Last line without '\n'
+        if not newlines.shape[0]:
+            raise ValueError(f"Line longer than {BLOCK_BYTES} bytes in {filename}")
+
+        starts = np.empty(newlines.shape[0], dtype=np.int64)
+        starts[0] = pos
+        starts[1:] = newlines[:-1] + 1
+        ends = newlines.astype(np.int64)
+        pos = int(newlines[-1]) + 1
+
+        n = starts.shape[0]
+        comma1 = np.empty(n, dtype=np.int64)
+        comma2 = np.empty(n, dtype=np.int64)
+        sizes = np.empty(n, dtype=np.int64)
+        phones = np.empty(n, dtype=np.int64)
+        providers = np.empty(n, dtype=np.int64)
+        micros = np.empty(n, dtype=np.int64)
+        ok = np.ones(n, dtype=np.bool_)
+        _parse_rows(data, starts, ends, comma1, comma2, sizes, fixed_size,
+                    prefixes, codes, PROVIDER_CODES['other'], phones, providers, micros, ok)
+        if (sizes < 0).any():
+            raise ValueError(f"Malformed CSV row in {filename}")
+        if not ok.all():
+            bad = np.flatnonzero(~ok)[0]
+            line = bytes(data[starts[bad]:ends[bad]]).decode('utf-8', 'replace')
+            raise ValueError(f"Unparseable phone/timestamp {line!r} in {filename}")
+
+        # Pre-sort so rows land in index key order (lexsort: last key is primary)
+        order = np.lexsort((phones, micros, providers))
+        comma1, comma2, sizes = comma1[order], comma2[order], sizes[order]
+        phones, providers, micros = phones[order], providers[order], micros[order]
+
+        offsets = np.zeros(n, dtype=np.int64)
+        np.cumsum(sizes[:-1], out=offsets[1:])
+        out = np.empty(int(sizes.sum()), dtype=np.uint8)
+        _encode_rows(data, comma1, comma2, sizes, offsets, phones, providers, micros, file_field, out)
+
+        if out.shape[0]:
+            yield io.BytesIO(COPY_BINARY_HEADER + out.tobytes() + COPY_BINARY_TRAILER)
+
+def _csv_is_empty(filename):
+    """True for an empty or header-only CSV, which PyArrow's reader rejects."""
+    with open(filename, 'rb') as f:
+        head = f.read(64 * 1024)
+    return len(head) < 64 * 1024 and not head.partition(b'\n')[2].strip()
+
+def _arrow_batches(filename):
+    """
+    Streams the CSV through PyArrow's C++ reader one block at a time and adds
+    the provider / file_source columns. Column names match raw_pool.
+    Each batch is sorted by (provider, imported_at, phone_number).
+    """
+    if _csv_is_empty(filename):
+        return # 0 rows, same as the csv.reader / Numba paths
+    reader = pa_csv.open_csv(
+        filename,
+        read_options=pa_csv.ReadOptions(use_threads=True, block_size=BLOCK_BYTES),
+        convert_options=pa_csv.ConvertOptions(column_types={
+            'phone': pa.string(), # Read as string for the prefix check, cast after
+            'url': pa.string(),
+            'timestamp': pa.timestamp('s'),
+        })
+    )
+    for batch in reader:
+        valid = pc.match_substring_regex(batch['phone'], f'^{PHONE_PATTERN}$')
+        if not pc.all(valid).as_py():
+            bad = batch['phone'].filter(pc.invert(valid))[0].as_py()
+            raise ValueError(f"Invalid phone number {bad!r} in {filename}")
+        yield pa.record_batch({
+            'phone_number': pc.cast(batch['phone'], pa.int64()),
+            'provider': classify_providers(batch['phone']),
+            'url_source': batch['url'],
+            'imported_at': batch['timestamp'],
+            'file_source': pa.repeat(filename, batch.num_rows),
+        }).sort_by([('provider', 'ascending'), ('imported_at', 'ascending'), ('phone_number', 'ascending')])
+
+def _arrow_copy_stream(batch):
+    """Re-encodes an Arrow batch as headerless CSV for copy_expert."""
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(batch, sink, write_options=pa_csv.WriteOptions(include_header=False))
+    return pa.BufferReader(sink.getvalue())
+
+def _ingest_adbc(filename):
+    """
+    Streams Arrow batches via ADBC, which uses binary COPY under the hood.
+    Batches are pulled lazily, memory stays at roughly one block.
+    One adbc_ingest (and commit) per COMMIT_EVERY batches; yields the
+    running committed row count after each commit.
+    """
+    # Credentials may contain URI delimiters ('@', ':', '/', '#')
+    user = urllib.parse.quote(DB_USER, safe='')
+    password = urllib.parse.quote(DB_PASS, safe='')
+    uri = f"postgresql://{user}:{password}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+    batches = _arrow_batches(filename)
+    row_count = 0
+    with adbc_pg.connect(uri) as conn:
+        with conn.cursor() as cur:
+            for first in batches:
+                # The group shares the generator, so the loop resumes after it
+                group = itertools.chain([first], itertools.islice(batches, COMMIT_EVERY - 1))
+                stream = pa.RecordBatchReader.from_batches(first.schema, group)
+                row_count += cur.adbc_ingest('raw_pool', stream, mode='append')
+                conn.commit()
+                yield row_count
+
+def _report_partial_ingest(filename, committed):
+    """
+    Periodic commits mean a failed ingest can leave part of the file loaded.
+    Chunks are committed in file order, so that part is exactly the first
+    `committed` data rows; say so instead of leaving a silent partial load.
+    """
+    if not committed:
+        print("  Nothing was committed.")
+        return
+    print(f"  {committed} rows (the first {committed} data rows of {filename}) were already committed.")
+    print("  Remove them before re-running to avoid loading them twice:")
+    print("  DELETE FROM raw_pool WHERE file_source = '%s';" % filename.replace("'", "''"))
+
+def ingest_file_postgres(filename):
+    """
+    High-performance ingestion using COPY FROM STDIN.
+    The file is streamed in chunks (one COPY per chunk, commit every
+    COMMIT_EVERY chunks), so memory stays constant even for 6GB files.
+    On failure, the rows already committed are reported (see _report_partial_ingest).
+    With PyArrow installed, parsing/provider tagging is done in C++ and the
+    batches are sent through ADBC (falls back to CSV COPY without ADBC).
+    Without PyArrow, a Numba kernel (if installed) encodes binary COPY rows.
+    """
+    if pa is not None and adbc_pg is not None:
+        committed = 0
+        try:
+            print("Ingesting records to Postgres via ADBC...")
+            start = time.time()
+            for committed in _ingest_adbc(filename):
+                pass
+            duration = time.time() - start
+            print(f"Ingested {committed} records in {duration:.2f}s ({committed/duration:.0f} rows/sec)")
+        except Exception as e:
+            print(f"Error ingestion: {e}")
+            _report_partial_ingest(filename, committed)
+        return
+
+    conn = get_db_connection()
+    committed = 0
+    try:
+        cur = conn.cursor()
+
+        print("Ingesting records to Postgres via COPY...")
+        start = time.time()
+
+        # COPY skips per-row SQL parsing/planning entirely
+        if pa is not None:
+            # Arrow's C++ CSV writer beats packing binary rows in Python
+            chunks = (_arrow_copy_stream(batch) for batch in _arrow_batches(filename))
+            copy_format = 'csv'
+        elif numba is not None:
+            # No PyArrow: JIT kernel parses and encodes binary rows natively
+            chunks = _numba_copy_chunks(filename)
+            copy_format = 'binary'
+        else:
+            chunks = _binary_copy_chunks(filename)
+            copy_format = 'binary'
+
+        query = f"""
+            COPY raw_pool (phone_number, provider, url_source, imported_at, file_source)
+            FROM STDIN WITH (FORMAT {copy_format})
+        """
+        row_count = 0
+        for i, chunk in enumerate(chunks, 1):
+            cur.copy_expert(query, chunk)
+            row_count += cur.rowcount
+            if i % COMMIT_EVERY == 0:
+                conn.commit()
+                committed = row_count
         
         conn.commit()
+        committed = row_count
         duration = time.time() - start
-        print(f"Ingested in {duration:.2f}s ({len(records)/duration:.0f} rows/sec)")
+        print(f"Ingested {row_count} records in {duration:.2f}s ({row_count/duration:.0f} rows/sec)")
         
     except Exception as e:
         conn.rollback()
         print(f"Error ingestion: {e}")
+        _report_partial_ingest(filename, committed)
     finally:
         cur.close()
         release_db_connection(conn)
 
-def process_order_postgres(customer_name, requirements):
+def _prepare_pick_order(conn):
     """
-    Order processing with Anti-Join on PostgreSQL
+    PREPAREs the order query once per pooled connection, so repeated
+    requirements skip parse/plan. Prepared statements live for the whole
+    session, so the connection is remembered instead of re-checking the server.
     """
+    if conn in prepared_conns:
+        return
+    with conn.cursor() as cur:
+        cur.execute(f"PREPARE pick_order(smallint, int, int, int, text) AS {PICK_ORDER_SQL};")
+    prepared_conns.add(conn)
+
+def _pick_numbers(customer_name, req, freshness_days, cutoff_days):
+    """
+    Runs one requirement on its own pool connection and transaction.
+    Executed from worker threads; psycopg2 releases the GIL while waiting on
+    the server, so requirements for different providers overlap.
+    """
+    provider = req['provider']
+    qty = req['qty']
+
+    print(f"  - Requesting {qty} {provider} numbers...")
+
     conn = get_db_connection()
-    results = {}
-    
     try:
         cur = conn.cursor()
-        
-        # Logic parameters
-        cutoff_days = 30 # Don't reuse numbers sold in last 30 days
-        freshness_days = 3 # Only take numbers imported in last 3 days
-        
-        print(f"\nProcessing Postgres order for {customer_name}...")
-        
-        for req in requirements:
-            provider = req['provider']
-            qty = req['qty']
-            
-            print(f"  - Requesting {qty} {provider} numbers...")
-            
-            # OPTIMIZED POSTGRES QUERY
-            # Uses CTEs and standard Anti-Join
-            # Postgres Partition pruning kicks in because of 'imported_at' filter
-            query = """
-                WITH Candidates AS (
-                    SELECT phone_number
-                    FROM raw_pool
-                    WHERE provider = %s
-                      AND imported_at >= NOW() - INTERVAL '%s days'
-                ),
-                Blacklist AS (
-                    SELECT phone_number
-                    FROM sales_history
-                    WHERE sold_at >= NOW() - INTERVAL '%s days'
-                )
-                SELECT c.phone_number
-                FROM Candidates c
-                LEFT JOIN Blacklist b ON c.phone_number = b.phone_number
-                WHERE b.phone_number IS NULL
-                LIMIT %s;
-            """
-            
-            start = time.time()
-            cur.execute(query, (provider, freshness_days, cutoff_days, qty))
-            found_numbers = [row[0] for row in cur.fetchall()]
-            duration = time.time() - start
-            
-            if len(found_numbers) < qty:
-                print(f"    WARNING: Shortage! Found {len(found_numbers)}/{qty}")
-            else:
-                print(f"    Success. Found {len(found_numbers)} in {duration:.4f}s")
-            
-            # Record Sale
-            if found_numbers:
-                insert_query = """
-                    INSERT INTO sales_history (phone_number, customer_name, sold_at)
-                    VALUES %s
-                """
-                sales_data = [(num, customer_name, datetime.datetime.now()) for num in found_numbers]
-                execute_values(cur, insert_query, sales_data)
-                results[provider] = found_numbers
-        
+        _prepare_pick_order(conn)
+
+        start = time.time()
+        cur.execute(
+            "EXECUTE pick_order(%s, %s, %s, %s, %s);",
+            (PROVIDER_CODES[provider], freshness_days, cutoff_days, qty, customer_name)
+        )
+
+        found_numbers = [row[0] for row in cur]
+        duration = time.time() - start
+
         conn.commit()
-    
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        print(f"Error processing order: {e}")
+        raise
     finally:
         cur.close()
         release_db_connection(conn)
+
+    if len(found_numbers) < qty:
+        print(f"    WARNING: Shortage on {provider}! Found {len(found_numbers)}/{qty}")
+    else:
+        print(f"    Success. Found {len(found_numbers)} {provider} in {duration:.4f}s")
+
+    return provider, found_numbers
+
+def process_order_postgres(customer_name, requirements):
+    """
+    Order processing with Anti-Join on PostgreSQL.
+    Requirements are independent (different partition trees), so they run
+    in parallel, each on its own pool connection and transaction.
+    """
+    results = {}
+    
+    # Logic parameters
+    cutoff_days = 30 # Don't reuse numbers sold in last 30 days
+    freshness_days = 3 # Only take numbers imported in last 3 days
+    
+    print(f"\nProcessing Postgres order for {customer_name}...")
+    
+    with ThreadPoolExecutor(max_workers=ORDER_WORKERS) as executor:
+        futures = [
+            executor.submit(_pick_numbers, customer_name, req, freshness_days, cutoff_days)
+            for req in requirements
+        ]
+        for future in as_completed(futures):
+            try:
+                provider, found_numbers = future.result()
+            except Exception as e:
+                print(f"Error processing order: {e}")
+                continue
+            if found_numbers:
+                results[provider] = found_numbers
         
     return results
 
+# --- ASYNCPG VARIANT: concurrent ingestion / per-provider order queries ---
+async def create_async_pool():
+    """Creates the asyncpg pool. Call once at startup and reuse."""
+    return await asyncpg.create_pool(
+        host=DB_HOST,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS,
+        port=DB_PORT,
+        min_size=10,
+        max_size=50,
+        server_settings=SESSION_SETTINGS
+    )
+
+def _parsed_records(filename):
+    """Yields typed tuples for asyncpg's binary COPY while the CSV is being read."""
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None) # Skip header
+        for row in reader:
+            if not row:
+                continue # Blank line
+            phone, url, ts = row
+            if not PHONE_RE.fullmatch(phone):
+                raise ValueError(f"Invalid phone number {phone!r} in {filename}")
+            provider = PREFIX_CODES.get(phone[:4], PROVIDER_CODES['other'])
+            yield (int(phone), provider, url, datetime.datetime.fromisoformat(ts), filename)
+
+async def ingest_file_postgres_async(pool, filename):
+    """
+    Ingestion through asyncpg's copy_records_to_table (binary COPY).
+    """
+    try:
+        async with pool.acquire() as conn:
+            print("Ingesting records to Postgres via asyncpg COPY...")
+            start = time.time()
+
+            status = await conn.copy_records_to_table(
+                'raw_pool',
+                records=_parsed_records(filename),
+                columns=['phone_number', 'provider', 'url_source', 'imported_at', 'file_source']
+            )
+            row_count = int(status.split()[-1])
+
+            duration = time.time() - start
+            print(f"Ingested {row_count} records in {duration:.2f}s ({row_count/duration:.0f} rows/sec)")
+    except Exception as e:
+        print(f"Error ingestion: {e}")
+
+async def _pick_numbers_async(pool, customer_name, req, freshness_days, cutoff_days):
+    """Runs one requirement on its own pool connection and transaction."""
+    provider = req['provider']
+    qty = req['qty']
+
+    print(f"  - Requesting {qty} {provider} numbers...")
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            start = time.time()
+            # Same single-statement pick + record as process_order_postgres
+            rows = await conn.fetch(PICK_ORDER_SQL, PROVIDER_CODES[provider], freshness_days, cutoff_days, qty, customer_name)
+            found_numbers = [row[0] for row in rows]
+            duration = time.time() - start
+
+            if len(found_numbers) < qty:
+                print(f"    WARNING: Shortage on {provider}! Found {len(found_numbers)}/{qty}")
+            else:
+                print(f"    Success. Found {len(found_numbers)} {provider} in {duration:.4f}s")
+
+    return provider, found_numbers
+
+async def process_order_postgres_async(pool, customer_name, requirements):
+    """
+    Same Anti-Join order processing, but every requirement runs concurrently
+    on a separate pool connection.
+    """
+    results = {}
+
+    # Logic parameters
+    cutoff_days = 30 # Don't reuse numbers sold in last 30 days
+    freshness_days = 3 # Only take numbers imported in last 3 days
+
+    print(f"\nProcessing Postgres order (async) for {customer_name}...")
+
+    tasks = [
+        asyncio.create_task(_pick_numbers_async(pool, customer_name, req, freshness_days, cutoff_days))
+        for req in requirements
+    ]
+    for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(outcome, Exception):
+            print(f"Error processing order: {outcome}")
+            continue
+        provider, found_numbers = outcome
+        if found_numbers:
+            results[provider] = found_numbers
+
+    return results
+
+async def run_async_demo(filename, customer_name, requirements):
+    pool = await create_async_pool()
+    try:
+        await ingest_file_postgres_async(pool, filename)
+        return await process_order_postgres_async(pool, customer_name, requirements)
+    finally:
+        await pool.close()
+# ---------------------------------------------------------------------------------------
+
 import random
 
 # ... (Previous imports remain)
@@ -219,14 +913,35 @@ def generate_dummy_file(filename, count=10000, date_str=None):
         date_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
     print(f"Generating {count} records into {filename}...")
-    with open(filename, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['phone', 'url', 'timestamp'])
-        for _ in range(count):
-            prov = random.choice(providers)
-            prefix = "0812" if prov == 'tsel' else "0857" if prov == 'isat' else "0819"
-            phone = f"{prefix}{random.randint(10000000, 99999999)}"
-            writer.writerow([phone, random.choice(urls), date_str])
+    if np is not None:
+        # Vectorized: draw whole columns at once instead of per-row random calls
+        # Same prefix per provider as below ('three' shares 0819 with 'xl')
+        prefixes = np.array(['0812', '0857', '0819', '0819'], dtype='U4')
+        suffixes = np.random.randint(10000000, 100000000, size=count).astype('U8')
+        phones = np.char.add(np.random.choice(prefixes, size=count), suffixes)
+        url_col = np.random.choice(np.array(urls, dtype='U16'), size=count)
+
+        if pa is not None:
+            table = pa.table({
+                'phone': pa.array(phones),
+                'url': pa.array(url_col),
+                'timestamp': pa.repeat(date_str, count),
+            })
+            pa_csv.write_csv(table, filename)
+        else:
+            with open(filename, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['phone', 'url', 'timestamp'])
+                writer.writerows(zip(phones.tolist(), url_col.tolist(), itertools.repeat(date_str)))
+    else:
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['phone', 'url', 'timestamp'])
+            for _ in range(count):
+                prov = random.choice(providers)
+                prefix = "0812" if prov == 'tsel' else "0857" if prov == 'isat' else "0819"
+                phone = f"{prefix}{random.randint(10000000, 99999999)}"
+                writer.writerow([phone, random.choice(urls), date_str])
     print("Done.")
 # ---------------------------------------------------------------------------------------
 
@@ -235,6 +950,7 @@ if __name__ == "__main__":
     if db_pool:
         print("--- initializing partitions ---")
         init_db_partitions()
+        init_sales_partitions()
         
         # 1. Generate Dummy Data
         print("\n1. Generating Dummy Data...")
@@ -242,16 +958,23 @@ if __name__ == "__main__":
         dummy_file = "data_postgres_test.csv"
         generate_dummy_file(dummy_file, count=3_000_000, date_str=today_str)
 
-        # 2. Ingest Data
-        print("\n2. Ingesting Data to Postgres...")
-        ingest_file_postgres(dummy_file)
-        
-        # 3. Process Order
-        print("\n3. Processing Order...")
-        process_order_postgres("Anto_Postgres_Test", [
+        order = [
             {'provider': 'tsel', 'qty': 1_000_000},
             {'provider': 'isat', 'qty': 1_000_000}
-        ])
+        ]
+
+        if USE_ASYNCPG and asyncpg is not None:
+            # 2 + 3. Ingest, then process the order, through asyncpg
+            print("\n2. Ingesting Data + 3. Processing Order (asyncpg)...")
+            asyncio.run(run_async_demo(dummy_file, "Anto_Postgres_Test", order))
+        else:
+            # 2. Ingest Data
+            print("\n2. Ingesting Data to Postgres...")
+            ingest_file_postgres(dummy_file)
+            
+            # 3. Process Order
+            print("\n3. Processing Order...")
+            process_order_postgres("Anto_Postgres_Test", order)
 
         # Cleanup
         try: